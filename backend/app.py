@@ -1,17 +1,33 @@
-from flask import Flask, request, jsonify
-from flask_cors import CORS
+from quart import Quart, request, jsonify, Response, send_from_directory
+from quart_cors import cors
+import aiofiles
+import asyncio
+import functools
+import hashlib
+import itertools
+import json
+import logging
 import os
 import shutil
+import tempfile
+import time
 from pathlib import Path
-import requests
+import httpx
+import orjson
 from gradio_client import Client, file
-from datetime import datetime
-from time import sleep
 from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+from cachetools import LRUCache, TTLCache
+from streaming_form_data import StreamingFormDataParser
+from streaming_form_data.parser import ParseFailedException
+from streaming_form_data.targets import FileTarget, ValueTarget
 
-# Initialize Flask app
-app = Flask(__name__)
-CORS(app)
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger("app")
+
+# Initialize Quart app (production: hypercorn app:app --workers 4 --worker-class uvloop --bind 0.0.0.0:5000)
+app = Quart(__name__)
+app = cors(app, allow_origin="*")
 
 # Define exact paths based on your directory structure
 BASE_DIR = Path(r"C:\Users\deeks\fashion-recommendation-sys")
@@ -19,30 +35,50 @@ BACKEND_DIR = BASE_DIR / "backend"
 UPLOADS_DIR = BACKEND_DIR / "uploads"
 PUBLIC_DIR = BASE_DIR / "frontend" / "public"
 
-# Print paths for verification
-print("\nDirectory Configuration:")
-print(f"Base Directory: {BASE_DIR}")
-print(f"Backend Directory: {BACKEND_DIR}")
-print(f"Uploads Directory: {UPLOADS_DIR}")
-print(f"Public Directory: {PUBLIC_DIR}")
+# Log paths for verification
+log.info("Base Directory: %s", BASE_DIR)
+log.info("Backend Directory: %s", BACKEND_DIR)
+log.info("Uploads Directory: %s", UPLOADS_DIR)
+log.info("Public Directory: %s", PUBLIC_DIR)
+
+# String forms of hot-path paths, computed once
+UPLOADS_DIR_STR = str(UPLOADS_DIR)
+PUBLIC_DIR_STR = str(PUBLIC_DIR)
+DEFAULT_IMAGE = os.path.join(PUBLIC_DIR_STR, 'image.JPEG')
+
+# When set (e.g. "/protected-public/"), /public/<file> hands the transfer to nginx via X-Accel-Redirect
+ACCEL_REDIRECT_PREFIX = os.environ.get("ACCEL_REDIRECT_PREFIX")
+
+# Cached downloads younger than this are reused without revalidating (seconds)
+DOWNLOAD_MAX_AGE = 3600
+# Generated results get unique filenames, so browsers may cache them forever
+PUBLIC_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# Read/write size used when streaming downloads to disk
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Shared async HTTP client (opened in before_serving) so downloads reuse pooled keep-alive connections
+HTTP: Optional[httpx.AsyncClient] = None
+HTTP_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=50)
+HTTP_TIMEOUT = httpx.Timeout(30, connect=3.05)
+# Direct model calls wait as long as an inference can take rather than the download read timeout
+PREDICT_TIMEOUT = httpx.Timeout(120, connect=3.05)
+
+# Bounded pool for blocking Gradio calls and downloads
+EXECUTOR = ThreadPoolExecutor(max_workers=16)
+
+# Memoized model outputs keyed by input text (generated images cache their PUBLIC_DIR filename)
+CHAT_CACHE = TTLCache(maxsize=1024, ttl=3600)
+PROMPT_CACHE = TTLCache(maxsize=256, ttl=3600)
+OCCASION_CACHE = TTLCache(maxsize=1024, ttl=3600)
+
+# Largest number of items accepted by the batch endpoints in one request
+MAX_BATCH_SIZE = 16
 
 # Create necessary directories
 UPLOADS_DIR.mkdir(exist_ok=True, parents=True)
 PUBLIC_DIR.mkdir(exist_ok=True, parents=True)
 
-def initialize_gradio_client(url: str, max_retries: int = 3) -> Optional[Client]:
-    """Initialize a Gradio client with retries"""
-    for attempt in range(max_retries):
-        try:
-            client = Client(url)
-            print(f"Successfully connected to {url}")
-            return client
-        except Exception as e:
-            print(f"Attempt {attempt + 1}/{max_retries} failed for {url}: {e}")
-            if attempt < max_retries - 1:
-                sleep(2)  # Wait 2 seconds before retrying
-    return None
-
 # Define client URLs with fallbacks
 CLIENTS = {
     "virtual_tryon": {
@@ -70,54 +106,405 @@ CLIENTS = {
     }
 }
 
-# Initialize clients with fallbacks
+# Clients are connected lazily on first use so unreachable spaces don't delay startup
 clients = {}
-for service_name, config in CLIENTS.items():
-    for url in config["urls"]:
-        client = initialize_gradio_client(url)
+_client_locks = {name: asyncio.Lock() for name in CLIENTS}
+# Connection happens on a user's request, so each URL only gets a short wait before the next is tried
+CLIENT_CONNECT_TIMEOUT = 10  # seconds per URL
+
+# (service, url) -> Client() construction still running after we stopped waiting for it
+_pending_connects = {}
+
+# Service -> time of its last failed connection; requests get a 503 straight away until the cooldown expires
+_client_failures = {}
+CLIENT_RETRY_COOLDOWN = 60  # seconds
+
+def _in_cooldown(service_name: str) -> bool:
+    """Whether a service failed to connect within the last CLIENT_RETRY_COOLDOWN seconds"""
+    failed_at = _client_failures.get(service_name)
+    return failed_at is not None and time.monotonic() - failed_at < CLIENT_RETRY_COOLDOWN
+
+def client_state(service_name: str) -> str:
+    """Current connection state of a service, without attempting to connect"""
+    if service_name in clients:
+        return 'available'
+    if _in_cooldown(service_name):
+        return 'unavailable'
+    return 'not_connected'
+
+def _adopt_late_client(service_name: str, url: str, task: asyncio.Future):
+    """Keep a client whose connection finished after its request stopped waiting"""
+    _pending_connects.pop((service_name, url), None)
+    if task.cancelled() or task.exception() is not None:
+        return
+    if service_name not in clients:
+        clients[service_name] = task.result()
+        _client_failures.pop(service_name, None)
+        log.info("Late connection to %s succeeded, %s client is now available", url, service_name)
+
+async def initialize_gradio_client(service_name: str, url: str, max_retries: int = 2) -> Optional[Client]:
+    """Initialize a Gradio client with retries and exponential backoff.
+
+    Each attempt is waited on for at most CLIENT_CONNECT_TIMEOUT; a slower
+    connection keeps running in the background and is adopted into
+    ``clients`` when it completes, so the caller can move on to the next URL.
+    """
+    for attempt in range(max_retries):
+        task = _pending_connects.get((service_name, url))
+        if task is None:
+            task = asyncio.ensure_future(run_blocking(Client, url))
+        try:
+            client = await asyncio.wait_for(asyncio.shield(task), CLIENT_CONNECT_TIMEOUT)
+            _pending_connects.pop((service_name, url), None)
+            log.info("Successfully connected to %s", url)
+            return client
+        except asyncio.TimeoutError:
+            if (service_name, url) not in _pending_connects:
+                _pending_connects[(service_name, url)] = task
+                task.add_done_callback(functools.partial(_adopt_late_client, service_name, url))
+            log.warning("Connecting to %s is taking over %ss, continuing in the background", url, CLIENT_CONNECT_TIMEOUT)
+            return None
+        except Exception as e:
+            _pending_connects.pop((service_name, url), None)
+            log.warning("Attempt %s/%s failed for %s: %s", attempt + 1, max_retries, url, e)
+            if attempt < max_retries - 1:
+                await asyncio.sleep(min(2 ** attempt, 4))  # 1s, 2s, ... capped at 4s
+    return None
+
+async def _connect_first_working(service_name: str) -> Optional[Client]:
+    """Try a service's URLs in order and return the first client that connects"""
+    for url in CLIENTS[service_name]["urls"]:
+        client = await initialize_gradio_client(service_name, url)
+        if client:
+            return client
+    return None
+
+async def get_client(service_name: str) -> Optional[Client]:
+    """Return the client for a service, connecting to the first working URL on first use"""
+    if service_name in clients:
+        return clients[service_name]
+    if _in_cooldown(service_name):
+        return None
+    async with _client_locks[service_name]:
+        # Another request may have connected, or just failed, while we waited
+        if service_name in clients:
+            return clients[service_name]
+        if _in_cooldown(service_name):
+            return None
+        client = await _connect_first_working(service_name)
         if client:
             clients[service_name] = client
-            print(f"Successfully initialized {service_name} client")
-            break
-    if service_name not in clients:
-        print(f"Failed to initialize {service_name} client")
+            _client_failures.pop(service_name, None)
+            log.info("Successfully initialized %s client", service_name)
+            return client
+        _client_failures[service_name] = time.monotonic()
+        log.error("Failed to initialize %s client, retrying after %ss", service_name, CLIENT_RETRY_COOLDOWN)
+        return None
+
+_filename_counter = itertools.count()
 
 def generate_unique_filename(original_name):
-    """Generate a unique filename using timestamp"""
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    return f"{timestamp}_{original_name}"
+    """Generate a unique filename from a nanosecond timestamp and a process-wide counter"""
+    return f"{time.time_ns()}_{next(_filename_counter)}_{original_name}"
 
 def safe_copy(src, dst):
     """Safely copy a file with error handling"""
     try:
-        shutil.copy(src, dst)
-        print(f"Successfully copied {src} to {dst}")
+        # copyfile does the in-kernel copy itself (sendfile on Linux, fcopyfile on macOS)
+        shutil.copyfile(src, dst)
+        log.debug("Successfully copied %s to %s", src, dst)
         return True
     except Exception as e:
-        print(f"Error copying file: {e}")
+        log.error("Error copying file: %s", e)
+        return False
+
+def safe_move(src, dst):
+    """Move a file we own into place, renaming when possible instead of copying"""
+    try:
+        os.replace(src, dst)
+        log.debug("Successfully moved %s to %s", src, dst)
+        return True
+    except OSError as e:
+        # Cross-filesystem rename fails; fall back to a copy
+        log.debug("Rename failed (%s), copying instead", e)
+    if not safe_copy(src, dst):
         return False
+    try:
+        os.unlink(src)
+    except OSError:
+        pass
+    return True
+
+@functools.lru_cache(maxsize=256)
+def download_path_for(image_url):
+    """Map an image URL to its cache file in the uploads directory"""
+    key = hashlib.sha256(image_url.encode()).hexdigest()[:16]
+    return os.path.join(UPLOADS_DIR_STR, f"{key}.png")
+
+def _validators_path(file_path):
+    """Sidecar file holding the HTTP validators for a cached download"""
+    return os.path.splitext(file_path)[0] + ".etag"
 
-def download_image(image_url):
-    """Download image from URL and save it locally"""
+def _load_validators(file_path):
+    """Read the ETag/Last-Modified stored next to a cached download"""
     try:
-        image_url = image_url.strip()
-        filename = "downloaded_image.png"
-        file_path = UPLOADS_DIR / filename
+        with open(_validators_path(file_path)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _save_validators(file_path, response):
+    """Remember the ETag/Last-Modified of a fresh download for later revalidation, or forget stale ones"""
+    validators = {
+        name: response.headers[name]
+        for name in ('ETag', 'Last-Modified')
+        if name in response.headers
+    }
+    if validators:
+        with open(_validators_path(file_path), 'w') as f:
+            json.dump(validators, f)
+    else:
+        # Validators from an earlier version would no longer describe this content
+        try:
+            os.unlink(_validators_path(file_path))
+        except FileNotFoundError:
+            pass
+
+async def _fetch_image(image_url):
+    """Download image from URL and save it locally, revalidating stale cached copies"""
+    try:
+        file_path = download_path_for(image_url)
+        headers = {}
+        try:
+            age = time.time() - os.path.getmtime(file_path)
+        except OSError:
+            age = None
+        if age is not None:
+            if age < DOWNLOAD_MAX_AGE:
+                log.debug("Using cached image %s", file_path)
+                return file_path
+            validators = _load_validators(file_path)
+            if 'ETag' in validators:
+                headers['If-None-Match'] = validators['ETag']
+            if 'Last-Modified' in validators:
+                headers['If-Modified-Since'] = validators['Last-Modified']
         
-        response = requests.get(image_url, stream=True)
-        if response.status_code == 200:
-            with open(file_path, 'wb') as file:
-                for chunk in response.iter_content(chunk_size=128):
-                    file.write(chunk)
-            print(f"Image downloaded successfully and saved as {file_path}")
-            return str(file_path)
-        else:
-            print(f"Failed to download image. Status code: {response.status_code}")
-            return None
+        try:
+            async with HTTP.stream("GET", image_url, headers=headers) as response:
+                if response.status_code == 304 and age is not None:
+                    os.utime(file_path)
+                    log.debug("Cached image still valid: %s", file_path)
+                    return file_path
+                if response.status_code != 200:
+                    log.warning("Failed to download image. Status code: %s", response.status_code)
+                    return None
+                # Write to a temp file and rename so readers never see a partial image
+                fd, tmp_path = tempfile.mkstemp(dir=UPLOADS_DIR, suffix=".part")
+                os.close(fd)
+                try:
+                    async with aiofiles.open(tmp_path, 'wb') as file:
+                        async for chunk in response.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
+                            await file.write(chunk)
+                    os.replace(tmp_path, file_path)
+                except BaseException:
+                    os.unlink(tmp_path)
+                    raise
+                _save_validators(file_path, response)
+        except httpx.HTTPError as e:
+            if age is None:
+                raise
+            log.warning("Revalidation failed (%s), using stale cached image %s", e, file_path)
+            return file_path
+        
+        log.debug("Image downloaded successfully and saved as %s", file_path)
+        return file_path
     except Exception as e:
-        print(f"Error downloading image: {e}")
+        log.error("Error downloading image: %s", e)
         return None
 
+# URL -> task currently fetching it, so concurrent requests share one download
+_inflight_downloads = {}
+
+# URL -> (cached path, time until which it is fresh); hits skip the disk stat entirely
+MEM_DOWNLOAD_CACHE = LRUCache(maxsize=512)
+
+async def download_image(image_url):
+    """Download an image, serving fresh copies from memory and coalescing concurrent fetches"""
+    image_url = image_url.strip()
+    entry = MEM_DOWNLOAD_CACHE.get(image_url)
+    if entry and entry[1] > time.time():
+        return entry[0]
+    
+    task = _inflight_downloads.get(image_url)
+    if task is None:
+        task = asyncio.ensure_future(_fetch_image(image_url))
+        _inflight_downloads[image_url] = task
+        task.add_done_callback(lambda _: _inflight_downloads.pop(image_url, None))
+    # Shield so one caller giving up doesn't cancel the download for the others
+    path = await asyncio.shield(task)
+    if path:
+        # Hits aren't stat'ed; callers that find the file gone evict it with forget_download
+        try:
+            MEM_DOWNLOAD_CACHE[image_url] = (path, os.path.getmtime(path) + DOWNLOAD_MAX_AGE)
+        except OSError:
+            MEM_DOWNLOAD_CACHE.pop(image_url, None)
+    return path
+
+def forget_download(image_url):
+    """Drop a URL from the memory tier, e.g. after its cached file turned out to be missing"""
+    MEM_DOWNLOAD_CACHE.pop(image_url.strip(), None)
+
+async def run_blocking(func, *args, **kwargs):
+    """Run a blocking callable on the shared executor"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(EXECUTOR, functools.partial(func, *args, **kwargs))
+
+async def predict_remote(service_name, *args):
+    """Call a Gradio service's /predict endpoint without blocking the event loop"""
+    return await run_blocking(clients[service_name].predict, *args, api_name="/predict")
+
+# Per-service URL of the raw /api/predict endpoint, or None once it proved unusable
+_direct_api_urls = {}
+
+async def predict_text(service_name, text):
+    """Text-in/text-out prediction that posts straight to the Space's HTTP API.
+
+    Skips the Gradio client's per-call marshalling; falls back to
+    predict_remote when the Space doesn't expose a compatible /api/predict.
+    Once the Space may have run the input (a 5xx, or a failure after the
+    request was sent) the error is raised rather than re-sending the input,
+    and later calls go through the Gradio client.
+    """
+    if service_name not in _direct_api_urls:
+        _direct_api_urls[service_name] = clients[service_name].src.rstrip('/') + '/api/predict'
+    url = _direct_api_urls[service_name]
+    if url:
+        try:
+            response = await HTTP.post(
+                url,
+                content=orjson.dumps({"data": [text]}),
+                headers={"content-type": "application/json"},
+                timeout=PREDICT_TIMEOUT
+            )
+            if response.status_code == 200:
+                return orjson.loads(response.content)["data"][0]
+            # Either the endpoint is missing/rejected the payload (4xx) or the Space
+            # failed while handling it (5xx); use the Gradio client from now on
+            _direct_api_urls[service_name] = None
+            if response.status_code >= 500:
+                log.warning("Direct API for %s returned %s; using Gradio client from now on", service_name, response.status_code)
+                raise RuntimeError(f"{service_name} service returned {response.status_code}")
+            log.info("Direct API for %s returned %s, using Gradio client", service_name, response.status_code)
+        except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+            # Nothing reached the Space, so falling back can't run the model twice
+            log.warning("Direct API call for %s failed to connect: %s", service_name, e)
+        except httpx.HTTPError as e:
+            # The Space may already be running this input: don't send it again, and
+            # stop using the direct route so later calls can't hit this either
+            log.warning("Direct API call for %s failed: %s; using Gradio client from now on", service_name, e)
+            _direct_api_urls[service_name] = None
+            raise
+        except (orjson.JSONDecodeError, KeyError, IndexError, TypeError):
+            log.info("Direct API for %s returned an unexpected payload, using Gradio client", service_name)
+            _direct_api_urls[service_name] = None
+    return await predict_remote(service_name, text)
+
+async def chat_reply(text_input):
+    """Chatbot answer for one message, memoized in CHAT_CACHE"""
+    if text_input in CHAT_CACHE:
+        return CHAT_CACHE[text_input]
+    result = await predict_text("chatbot", text_input)
+    CHAT_CACHE[text_input] = result
+    return result
+
+async def recommend_items(color, occasion):
+    """Recommended item URLs for a color/occasion pair, memoized in OCCASION_CACHE"""
+    query = f"{color} shirt for {occasion}"
+    if query not in OCCASION_CACHE:
+        OCCASION_CACHE[query] = await predict_text("occasion", query)
+    return OCCASION_CACHE[query].split(",")
+
+async def fan_out(func, keys):
+    """Await func(key) once per distinct key, concurrently.
+
+    Returns (results, errors) aligned with keys: a key whose call failed gets
+    a None result and its error message, rather than failing the whole batch.
+    """
+    unique = list(dict.fromkeys(keys))
+    outcomes = await asyncio.gather(*[func(key) for key in unique], return_exceptions=True)
+    by_key = dict(zip(unique, outcomes))
+    results, errors = [], []
+    for key in keys:
+        outcome = by_key[key]
+        if isinstance(outcome, BaseException):
+            log.error("Batch item %r failed: %s", key, outcome)
+            results.append(None)
+            errors.append(str(outcome))
+        else:
+            results.append(outcome)
+            errors.append(None)
+    return results, errors
+
+class _FieldTarget(ValueTarget):
+    """ValueTarget that reports its value as soon as the field is fully parsed"""
+
+    def __init__(self, name, on_field):
+        super().__init__()
+        self._name = name
+        self._on_field = on_field
+
+    async def on_finish_async(self):
+        if self._on_field:
+            self._on_field(self._name, self.value.decode())
+
+def new_upload_path():
+    """Reserve a per-request file for an uploaded photo so concurrent try-ons never share one"""
+    fd, path = tempfile.mkstemp(dir=UPLOADS_DIR, suffix=".png")
+    os.close(fd)
+    return path
+
+def discard_upload(path):
+    """Remove a per-request upload once the model has consumed it"""
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+async def receive_upload(upload_path, fields=(), on_field=None):
+    """Stream the multipart 'uploadedFile' part straight to disk.
+
+    Returns the client-side filename (None if the part was missing or the
+    body isn't valid multipart) and a dict of the requested text fields. If
+    given, on_field(name, value) is called for each field as soon as it has
+    been parsed, while the rest of the body is still streaming.
+    """
+    file_target = FileTarget(upload_path)
+    value_targets = {name: _FieldTarget(name, on_field) for name in fields}
+    try:
+        parser = StreamingFormDataParser(headers={'Content-Type': request.headers.get('Content-Type', '')})
+        parser.register('uploadedFile', file_target)
+        for name, target in value_targets.items():
+            parser.register(name, target)
+
+        # Async targets: FileTarget writes through aiofiles without blocking the loop
+        async for chunk in request.body:
+            await parser.adata_received(chunk)
+    except ParseFailedException as e:
+        log.debug("Rejected upload body: %s", e)
+        return None, {}
+
+    form = {name: target.value.decode() for name, target in value_targets.items()}
+    return file_target.multipart_filename, form
+
+@app.before_serving
+async def open_http_client():
+    global HTTP
+    HTTP = httpx.AsyncClient(limits=HTTP_LIMITS, timeout=HTTP_TIMEOUT)
+
+@app.after_serving
+async def close_http_client():
+    await HTTP.aclose()
+
 @app.errorhandler(503)
 def service_unavailable(error):
     return jsonify({
@@ -133,78 +520,111 @@ def internal_server_error(error):
     }), 500
 
 @app.route('/health', methods=['GET'])
-def health_check():
+async def health_check():
     """Health check endpoint"""
     return jsonify({
         'status': 'healthy',
         'directories': {
-            'public': str(PUBLIC_DIR),
-            'uploads': str(UPLOADS_DIR),
+            'public': PUBLIC_DIR_STR,
+            'uploads': UPLOADS_DIR_STR,
         },
         'directories_exist': {
             'public': PUBLIC_DIR.exists(),
             'uploads': UPLOADS_DIR.exists(),
         },
         'services': {
-            name: 'available' if name in clients else 'unavailable'
-            for name in CLIENTS.keys()
+            name: client_state(name)
+            for name in CLIENTS
         }
     })
 
 @app.route("/predict", methods=["POST"])
-def predict():
+async def predict():
     """Endpoint for chatbot predictions"""
     try:
-        if "chatbot" not in clients:
+        if await get_client("chatbot") is None:
             return jsonify({'error': 'Chatbot service not available'}), 503
 
-        data = request.get_json()
+        data = await request.get_json()
         text_input = data["text"]
-        print(f"Received input: {text_input}")
+        log.debug("Received input: %s", text_input)
         
-        result = clients["chatbot"].predict(
-            text_input,
-            api_name="/predict"
-        )
-        print(f"Prediction result: {result}")
+        result = await chat_reply(text_input)
+        log.debug("Prediction result: %s", result)
         return jsonify({"result": result})
     except Exception as e:
-        print(f"Error in predict: {e}")
+        log.error("Error in predict: %s", e)
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/predict_batch", methods=["POST"])
+async def predict_batch():
+    """Endpoint for answering several chatbot messages concurrently"""
+    try:
+        if await get_client("chatbot") is None:
+            return jsonify({'error': 'Chatbot service not available'}), 503
+
+        data = await request.get_json()
+        texts = data.get("texts") if isinstance(data, dict) else None
+        if not texts or not isinstance(texts, list) or not all(isinstance(text, str) for text in texts):
+            return jsonify({'error': 'texts must be a non-empty list of strings'}), 400
+        if len(texts) > MAX_BATCH_SIZE:
+            return jsonify({'error': f'At most {MAX_BATCH_SIZE} texts per request'}), 400
+        
+        results, errors = await fan_out(chat_reply, texts)
+        return jsonify({"results": results, "errors": errors})
+    except Exception as e:
+        log.error("Error in predict_batch: %s", e)
         return jsonify({"error": str(e)}), 500
 
 @app.route('/uploadocassion', methods=['POST'])
-def upload_ocassion():
+async def upload_ocassion():
     """Endpoint for occasion-based virtual try-on"""
     try:
-        if "virtual_tryon" not in clients:
+        if await get_client("virtual_tryon") is None:
             return jsonify({'error': 'Virtual try-on service not available'}), 503
 
-        if 'uploadedFile' not in request.files:
-            return jsonify({'error': 'No file part'}), 400
+        # Start the garment download as soon as the url field is parsed so it
+        # overlaps with the rest of the upload streaming to disk
+        downloads = {}
+        def start_download(name, value):
+            downloads[name] = asyncio.ensure_future(download_image(value))
         
-        uploaded_file = request.files['uploadedFile']
-        url = request.form['url']
-        
-        downloaded_path = download_image(url)
-        if not downloaded_path:
-            return jsonify({'error': 'Failed to download image'}), 500
-        
-        if uploaded_file.filename == '':
-            return jsonify({'error': 'No selected file'}), 400
-        
-        upload_path = UPLOADS_DIR / 'upload.png'
-        uploaded_file.save(upload_path)
-        
-        result = clients["virtual_tryon"].predict(
-            file(downloaded_path),
-            file(str(upload_path)),
-            api_name="/predict"
-        )
+        upload_path = new_upload_path()
+        try:
+            filename, form = await receive_upload(upload_path, fields=('url',), on_field=start_download)
+            if filename is None or filename == '':
+                if 'url' in downloads:
+                    downloads['url'].cancel()
+                if filename is None:
+                    return jsonify({'error': 'No file part'}), 400
+                return jsonify({'error': 'No selected file'}), 400
+            
+            download = downloads.get('url') or asyncio.ensure_future(download_image(form['url']))
+            downloaded_path = await download
+            if not downloaded_path:
+                return jsonify({'error': 'Failed to download image'}), 500
+            try:
+                garment = file(downloaded_path)
+            except ValueError:
+                # Memory tier pointed at a file removed from disk; evict it and fetch once more
+                forget_download(form['url'])
+                downloaded_path = await download_image(form['url'])
+                if not downloaded_path:
+                    return jsonify({'error': 'Failed to download image'}), 500
+                garment = file(downloaded_path)
+            
+            result = await predict_remote(
+                "virtual_tryon",
+                garment,
+                file(upload_path)
+            )
+        finally:
+            discard_upload(upload_path)
         
         result_filename = generate_unique_filename("result.png")
-        destination = PUBLIC_DIR / result_filename
+        destination = os.path.join(PUBLIC_DIR_STR, result_filename)
         
-        if safe_copy(result, str(destination)):
+        if safe_move(result, destination):
             return jsonify({
                 'message': 'Result image copied successfully.',
                 'filename': result_filename
@@ -213,36 +633,37 @@ def upload_ocassion():
             return jsonify({'error': 'Failed to save result image'}), 500
             
     except Exception as e:
-        print(f"Error in upload_ocassion: {e}")
+        log.error("Error in upload_ocassion: %s", e)
         return jsonify({'error': str(e)}), 500
 
 @app.route('/upload', methods=['POST'])
-def upload_files():
+async def upload_files():
     """Endpoint for regular virtual try-on"""
     try:
-        if "virtual_tryon" not in clients:
+        if await get_client("virtual_tryon") is None:
             return jsonify({'error': 'Virtual try-on service not available'}), 503
 
-        if 'uploadedFile' not in request.files:
-            return jsonify({'error': 'No file part'}), 400
-            
-        uploaded_file = request.files['uploadedFile']
-        if uploaded_file.filename == '':
-            return jsonify({'error': 'No selected file'}), 400
+        upload_path = new_upload_path()
+        try:
+            filename, _ = await receive_upload(upload_path)
+            if filename is None:
+                return jsonify({'error': 'No file part'}), 400
+                
+            if filename == '':
+                return jsonify({'error': 'No selected file'}), 400
             
-        upload_path = UPLOADS_DIR / 'upload.png'
-        uploaded_file.save(upload_path)
-        
-        result = clients["virtual_tryon"].predict(
-            file(str(PUBLIC_DIR / "image.JPEG")),
-            file(str(upload_path)),
-            api_name="/predict"
-        )
+            result = await predict_remote(
+                "virtual_tryon",
+                file(DEFAULT_IMAGE),
+                file(upload_path)
+            )
+        finally:
+            discard_upload(upload_path)
         
         result_filename = generate_unique_filename("result.png")
-        destination = PUBLIC_DIR / result_filename
+        destination = os.path.join(PUBLIC_DIR_STR, result_filename)
         
-        if safe_copy(result, str(destination)):
+        if safe_move(result, destination):
             return jsonify({
                 'message': 'Result image copied successfully.',
                 'filename': result_filename
@@ -251,32 +672,40 @@ def upload_files():
             return jsonify({'error': 'Failed to save result image'}), 500
             
     except Exception as e:
-        print(f"Error in upload_files: {e}")
+        log.error("Error in upload_files: %s", e)
         return jsonify({'error': str(e)}), 500
 
 @app.route('/handleprompt', methods=['POST'])
-def handle_prompt():
+async def handle_prompt():
     """Endpoint for text-to-dress generation"""
     try:
-        if "text_to_dress" not in clients:
+        if await get_client("text_to_dress") is None:
             return jsonify({'error': 'Text-to-dress service not available'}), 503
 
-        data = request.get_json()
+        data = await request.get_json()
         prompt = data.get('prompt')
         if not prompt:
             return jsonify({'error': 'No prompt provided'}), 400
             
-        print(f"Received prompt: {prompt}")
+        log.debug("Received prompt: %s", prompt)
         
-        result = clients["text_to_dress"].predict(
-            prompt,
-            api_name="/predict"
+        cached_filename = PROMPT_CACHE.get(prompt)
+        if cached_filename and os.path.exists(os.path.join(PUBLIC_DIR_STR, cached_filename)):
+            return jsonify({
+                'message': 'Success',
+                'filename': cached_filename
+            }), 200
+        
+        result = await predict_remote(
+            "text_to_dress",
+            prompt
         )
         
         result_filename = generate_unique_filename("generated_dress.png")
-        destination = PUBLIC_DIR / result_filename
+        destination = os.path.join(PUBLIC_DIR_STR, result_filename)
         
-        if safe_copy(result, str(destination)):
+        if safe_move(result, destination):
+            PROMPT_CACHE[prompt] = result_filename
             return jsonify({
                 'message': 'Success',
                 'filename': result_filename
@@ -285,44 +714,122 @@ def handle_prompt():
             return jsonify({'error': 'Failed to save generated image'}), 500
             
     except Exception as e:
-        print(f"Error in handle_prompt: {e}")
+        log.error("Error in handle_prompt: %s", e)
         return jsonify({'error': str(e)}), 500
 
 @app.route('/handleocassion', methods=['POST'])
-def handleocassion():
+async def handleocassion():
     """Endpoint for occasion-based recommendations"""
     try:
-        if "occasion" not in clients:
+        if await get_client("occasion") is None:
             return jsonify({'error': 'Occasion service not available'}), 503
 
-        data = request.json
+        data = await request.get_json()
         color = data.get('color')
         selected_occasion = data.get('selectedOccasion')
         
         if not color or not selected_occasion:
             return jsonify({'error': 'Color and occasion are required'}), 400
             
-        print(f"Color: {color}, Occasion: {selected_occasion}")
-        
-        result = clients["occasion"].predict(
-            f"{color} shirt for {selected_occasion}",
-            api_name="/predict"
-        )
+        log.debug("Color: %s, Occasion: %s", color, selected_occasion)
         
-        new_items = result.split(",")
+        new_items = await recommend_items(color, selected_occasion)
         
         return jsonify({
             'newItems': new_items,
             'showRecommendations': True
         })
     except Exception as e:
-        print(f"Error in handleocassion: {e}")
+        log.error("Error in handleocassion: %s", e)
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/handleocassion_batch', methods=['POST'])
+async def handleocassion_batch():
+    """Endpoint for recommendations for several color/occasion pairs at once"""
+    try:
+        if await get_client("occasion") is None:
+            return jsonify({'error': 'Occasion service not available'}), 503
+
+        data = await request.get_json()
+        queries = data.get('queries') if isinstance(data, dict) else None
+        if not queries or not isinstance(queries, list):
+            return jsonify({'error': 'queries must be a non-empty list'}), 400
+        if len(queries) > MAX_BATCH_SIZE:
+            return jsonify({'error': f'At most {MAX_BATCH_SIZE} queries per request'}), 400
+        if any(
+            not isinstance(q, dict)
+            or not isinstance(q.get('color'), str) or not q['color']
+            or not isinstance(q.get('selectedOccasion'), str) or not q['selectedOccasion']
+            for q in queries
+        ):
+            return jsonify({'error': 'Color and occasion are required'}), 400
+        
+        results, errors = await fan_out(
+            lambda pair: recommend_items(*pair),
+            [(q['color'], q['selectedOccasion']) for q in queries]
+        )
+        
+        return jsonify({
+            'newItems': results,
+            'errors': errors,
+            'showRecommendations': True
+        })
+    except Exception as e:
+        log.error("Error in handleocassion_batch: %s", e)
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/public/<filename>', methods=['GET'])
+async def serve_public(filename):
+    """Serve a generated image, delegating the transfer to nginx when configured"""
+    if filename in ('.', '..'):
+        return jsonify({'error': 'Not found'}), 404
+    if ACCEL_REDIRECT_PREFIX:
+        return Response('', headers={
+            'X-Accel-Redirect': f"{ACCEL_REDIRECT_PREFIX.rstrip('/')}/{filename}",
+            'Cache-Control': PUBLIC_CACHE_CONTROL,
+        })
+    response = await send_from_directory(PUBLIC_DIR_STR, filename)
+    response.headers['Cache-Control'] = PUBLIC_CACHE_CONTROL
+    return response
+
+@app.route('/batch_download', methods=['POST'])
+async def batch_download():
+    """Endpoint for warming the download cache with recommended item images.
+
+    Fetches all urls concurrently so a later /uploadocassion for any of
+    them skips the download; reports per url whether it is now cached.
+    """
+    try:
+        data = await request.get_json()
+        urls = data.get('urls') if isinstance(data, dict) else None
+        if not urls or not isinstance(urls, list) or not all(isinstance(url, str) for url in urls):
+            return jsonify({'error': 'urls must be a non-empty list of strings'}), 400
+        if len(urls) > MAX_BATCH_SIZE:
+            return jsonify({'error': f'At most {MAX_BATCH_SIZE} urls per request'}), 400
+            
+        paths = await asyncio.gather(*[download_image(url) for url in urls])
+        # Off the hot path, so confirm memory-tier answers against the disk
+        for i, (url, path) in enumerate(zip(urls, paths)):
+            if path and not os.path.exists(path):
+                forget_download(url)
+                paths[i] = await download_image(url)
+        
+        return jsonify({
+            'cached': [path is not None for path in paths]
+        })
+    except Exception as e:
+        log.error("Error in batch_download: %s", e)
         return jsonify({'error': str(e)}), 500
 
 if __name__ == '__main__':
     # Verify directories exist before starting server
-    print("\nVerifying directories before start:")
-    print(f"Uploads directory exists: {UPLOADS_DIR.exists()}")
-    print(f"Public directory exists: {PUBLIC_DIR.exists()}")
+    log.info("Uploads directory exists: %s", UPLOADS_DIR.exists())
+    log.info("Public directory exists: %s", PUBLIC_DIR.exists())
+    
+    # Serve with hypercorn rather than the single-process debug server with reloader
+    from hypercorn.asyncio import serve
+    from hypercorn.config import Config
     
-    app.run(debug=True)
+    config = Config()
+    config.bind = ["127.0.0.1:5000"]
+    asyncio.run(serve(app, config))
@@ -203,8 +203,9 @@ function Chat() {
     
                 // Create a FormData object to hold the files
                 const formData = new FormData();
-                formData.append('uploadedFile', file);
+                // Send the url first so the backend can start downloading it while the photo uploads
                 formData.append('url', selectedImageUrl);
+                formData.append('uploadedFile', file);
                 // Send the files to the Flask server
                 
                 const response = await axios.post('http://127.0.0.1:5000/uploadocassion', formData, {